@@ -199,7 +199,7 @@ const App: React.FC = () => {
     // Initialize audio capture (sends audio to backend)
     audioCapture.current = new AudioCaptureService((pcmData) => {
       if (socketService.current) {
-        socketService.current.send('audio', { data: pcmData });
+        socketService.current.sendAudio(pcmData);
       }
     });
 
@@ -0,0 +1,45 @@
+# cython: language_level=3
+"""
+Compiled per-session audio buffer. Built on import via pyximport when Cython
+is installed; audio_buffer.py is the pure-Python fallback with the same API.
+"""
+
+
+cdef class AudioBuffer:
+    """Accumulates PCM for one user and returns header-prefixed frames when full"""
+
+    cdef bytearray buf
+    cdef Py_ssize_t header_len
+    cdef Py_ssize_t pos
+    cdef double last_send
+
+    def __cinit__(self, bytes header, double now, Py_ssize_t capacity):
+        # Preallocated storage with the header written once at the front; pos is the
+        # write index. Flushing only rewinds pos, so the allocation is kept across frames.
+        self.header_len = len(header)
+        self.buf = bytearray(self.header_len + capacity)
+        self.buf[:self.header_len] = header
+        self.pos = self.header_len
+        self.last_send = now
+
+    cpdef object append(self, pcm, double now, Py_ssize_t target_bytes):
+        """Add PCM and return a ready frame, or None if still buffering"""
+        cdef Py_ssize_t end = self.pos + len(pcm)
+        cdef Py_ssize_t n
+        if end > len(self.buf):
+            # Grow once for an oversized burst; the larger capacity is kept afterwards
+            self.buf.extend(bytes(end - len(self.buf)))
+
+        with memoryview(self.buf) as view:
+            view[self.pos:end] = pcm
+            n = end - self.header_len
+
+            # Send at target size, or if it's been more than 40ms since last send
+            if n >= target_bytes or (n > 0 and now - self.last_send > 0.04):
+                frame = bytes(view[:end])  # The one copy: the frame handed to the sender
+                self.pos = self.header_len
+                self.last_send = now
+                return frame
+
+        self.pos = end
+        return None
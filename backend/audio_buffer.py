@@ -0,0 +1,42 @@
+"""
+Pure-Python per-session audio buffer, used when the Cython build of
+_audio_buffer.pyx is unavailable.
+"""
+
+from typing import Optional
+
+
+class AudioBuffer:
+    """Accumulates PCM for one user and returns header-prefixed frames when full"""
+
+    __slots__ = ("buf", "header_len", "pos", "last_send")
+
+    def __init__(self, header: bytes, now: float, capacity: int):
+        # Preallocated storage with the header written once at the front; pos is the
+        # write index. Flushing only rewinds pos, so the allocation is kept across frames.
+        self.buf = bytearray(len(header) + capacity)
+        self.buf[:len(header)] = header
+        self.header_len = len(header)
+        self.pos = self.header_len
+        self.last_send = now
+
+    def append(self, pcm, now: float, target_bytes: int) -> Optional[bytes]:
+        """Add PCM and return a ready frame, or None if still buffering"""
+        end = self.pos + len(pcm)
+        if end > len(self.buf):
+            # Grow once for an oversized burst; the larger capacity is kept afterwards
+            self.buf.extend(bytes(end - len(self.buf)))
+
+        with memoryview(self.buf) as view:
+            view[self.pos:end] = pcm
+            n = end - self.header_len
+
+            # Send at target size, or if it's been more than 40ms since last send
+            if n >= target_bytes or (n > 0 and now - self.last_send > 0.04):
+                frame = bytes(view[:end])  # The one copy: the frame handed to the sender
+                self.pos = self.header_len
+                self.last_send = now
+                return frame
+
+        self.pos = end
+        return None
@@ -4,22 +4,81 @@ WebMumble Backend - Python WebSocket bridge to Mumble servers
 """
 
 import asyncio
-import json
-import base64
+import os
 import ssl
 import socket
+import struct
 import logging
+import queue
 from typing import Optional, Dict, Any, Tuple
 import threading
+from collections import defaultdict, deque
 import time as time_module
+import warnings
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import orjson
 import websockets
 import pymumble_py3 as pymumble
 import pymumble_py3.mumble
-from pymumble_py3.constants import PYMUMBLE_CLBK_SOUNDRECEIVED, PYMUMBLE_CLBK_TEXTMESSAGERECEIVED, PYMUMBLE_CLBK_USERCREATED, PYMUMBLE_CLBK_USERUPDATED, PYMUMBLE_CLBK_USERREMOVED, PYMUMBLE_CLBK_CHANNELCREATED, PYMUMBLE_CLBK_CHANNELUPDATED, PYMUMBLE_CLBK_CHANNELREMOVED, PYMUMBLE_CLBK_CONNECTED, PYMUMBLE_CLBK_DISCONNECTED
+from pymumble_py3 import mumble_pb2, messages
+from pymumble_py3.errors import TextTooLongError, ImageTooBigError
+from pymumble_py3.constants import PYMUMBLE_CLBK_SOUNDRECEIVED, PYMUMBLE_CLBK_TEXTMESSAGERECEIVED, PYMUMBLE_CLBK_USERCREATED, PYMUMBLE_CLBK_USERUPDATED, PYMUMBLE_CLBK_USERREMOVED, PYMUMBLE_CLBK_CHANNELCREATED, PYMUMBLE_CLBK_CHANNELUPDATED, PYMUMBLE_CLBK_CHANNELREMOVED, PYMUMBLE_CLBK_CONNECTED, PYMUMBLE_CLBK_DISCONNECTED, PYMUMBLE_MSG_TYPES_TEXTMESSAGE
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Prefer the Cython audio buffer, compiled on import when Cython is installed
+try:
+    import pyximport
+    pyximport.install(language_level=3)
+    from _audio_buffer import AudioBuffer
+except ImportError:
+    from audio_buffer import AudioBuffer
+
+# audioop (C) provides the mu-law encoder; it left the stdlib in 3.13, where audioop-lts replaces it
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import audioop
+except ImportError:
+    audioop = None
+
+# Binary WebSocket frame header: msg-type byte, session u32, sample rate u16 (little-endian).
+# The msg-type byte also names the codec of the audio that follows.
+AUDIO_TAG = 0x01  # 16-bit linear PCM
+AUDIO_ULAW_TAG = 0x02  # 8-bit G.711 mu-law
+AUDIO_TAGS = (AUDIO_TAG, AUDIO_ULAW_TAG)
+AUDIO_HEADER = struct.Struct("<BIH")
+
+# Worker processes for audio framing/encoding (WEBMUMBLE_AUDIO_WORKERS); 0 keeps it on the event
+# loop. Shipping each frame to a worker costs more than lin2ulaw itself, so only enable with many
+# concurrent talkers.
+AUDIO_ENCODE_WORKERS = int(os.environ.get("WEBMUMBLE_AUDIO_WORKERS", "0"))
+_audio_pool: Optional[ProcessPoolExecutor] = None
+
+# Upper bound on JSON messages coalesced into a single WebSocket frame
+OUTBOX_MAX_BATCH = 64
+
+# Delay used to coalesce bursts of user/channel changes into one tree sync
+TREE_SYNC_DEBOUNCE = 0.05
+
+
+def encode_audio_frame(tag: int, session: int, pcm: bytes) -> bytes:
+    """Frame a buffer of 16-bit PCM for the browser (runs in the audio worker pool)"""
+    if tag == AUDIO_ULAW_TAG:
+        pcm = audioop.lin2ulaw(pcm, 2)
+    return AUDIO_HEADER.pack(tag, session, 48000) + pcm
+
+
+def _disable_audio_pool():
+    """Shut down a broken audio pool; clients then encode on the event loop"""
+    global _audio_pool
+    if _audio_pool is not None:
+        _audio_pool.shutdown(wait=False, cancel_futures=True)
+        _audio_pool = None
+
 
 def patch_pymumble_ssl():
     """Monkey-patch pymumble to accept self-signed certificates with modern SSL"""
@@ -44,6 +103,8 @@ def patch_pymumble_ssl():
 
             std_sock = socket.socket(server_info[0][0], socket.SOCK_STREAM)
             std_sock.settimeout(10)
+            # Disable Nagle so small control messages (chat, video fragments) go out immediately
+            std_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         except socket.error:
             self.connected = PYMUMBLE_CONN_STATE_FAILED
             return self.connected
@@ -90,8 +151,53 @@ def patch_pymumble_ssl():
     mumble_module.Mumble.connect = patched_connect
 
 
-# Apply the patch
+# Command id for a pre-serialized control packet, handled by the patched treat_command
+WM_CMD_SEND_PACKET = "wm_send_packet"
+
+
+class SendPacketCmd(messages.Cmd):
+    """Command carrying an already serialized control packet for the pymumble thread"""
+
+    def __init__(self, packet: bytes):
+        messages.Cmd.__init__(self)
+
+        self.cmd = WM_CMD_SEND_PACKET
+        self.parameters = {"packet": packet}
+
+
+def patch_pymumble_commands():
+    """Monkey-patch pymumble to send pre-serialized packets queued as commands"""
+    import pymumble_py3.mumble as mumble_module
+
+    original_treat_command = mumble_module.Mumble.treat_command
+
+    def patched_treat_command(self, cmd):
+        """Send SendPacketCmd packets on the pymumble thread, defer everything else"""
+        if cmd.cmd != WM_CMD_SEND_PACKET:
+            return original_treat_command(self, cmd)
+
+        # Same write loop as Mumble.send_message, on the thread that owns the socket
+        packet = cmd.parameters["packet"]
+        while len(packet) > 0:
+            sent = self.control_socket.send(packet)
+            if sent < 0:
+                raise socket.error("Server socket error")
+            packet = packet[sent:]
+        cmd.response = True
+        self.commands.answer(cmd)
+
+    mumble_module.Mumble.treat_command = patched_treat_command
+
+
+# Apply the patches
 patch_pymumble_ssl()
+patch_pymumble_commands()
+
+def _utf8_len(text: str) -> int:
+    """UTF-8 byte length of text, without encoding when it is pure ASCII"""
+    # str.isascii() reads a flag on the string object, so it does not scan or allocate
+    return len(text) if text.isascii() else len(text.encode('utf-8'))
+
 
 class MumbleClient:
     """Manages a Mumble connection for a WebSocket client"""
@@ -102,20 +208,86 @@ class MumbleClient:
         self.connected = False
         self.loop = asyncio.get_event_loop()
         # Audio buffering per user to reduce packet overhead
-        self.audio_buffers: Dict[int, bytearray] = {}
-        self.audio_flush_task: Optional[asyncio.Task] = None
+        self.audio_buffers: Dict[int, AudioBuffer] = {}
         self.AUDIO_BUFFER_MS = 60  # Buffer 60ms of audio before sending
+        # Forward received audio as mu-law, halving outbound audio bytes
+        self.AUDIO_ULAW = audioop is not None
+        self._audio_tag = AUDIO_ULAW_TAG if self.AUDIO_ULAW else AUDIO_TAG
+        # With a worker pool, buffers hold raw PCM and frames are built by encode_audio_frame
+        self._raw_frames = _audio_pool is not None
+        # 60ms worth = 2880 samples at 48kHz mono (5760 bytes as 16-bit PCM, 2880 as mu-law)
+        bytes_per_sample = 1 if self.AUDIO_ULAW and not self._raw_frames else 2
+        self._audio_target_bytes = int(self.AUDIO_BUFFER_MS * 48000 * bytes_per_sample / 1000)
+        self._now = time_module.monotonic  # Bound once for the audio hot path
+        # Received audio is handed off by the pymumble thread and framed on the event loop
+        self._audio_q: queue.SimpleQueue = queue.SimpleQueue()
+        self._audio_event = asyncio.Event()
+        # Outbound frames, pre-encoded by the producer: JSON messages are
+        # coalesced into one array per loop iteration, audio frames go out as-is
+        self._outbox: queue.SimpleQueue = queue.SimpleQueue()
+        self._outbox_event = asyncio.Event()
+        self._outbox_task = self.loop.create_task(self._flush_outbox())
+        self.audio_flush_task: asyncio.Task = self.loop.create_task(self._flush_audio())
+        self._tree_timer: Optional[asyncio.TimerHandle] = None
+        self._last_tree_payload: Optional[bytes] = None
+        # Reusable TextMessage per channel; only .message changes between sends
+        self._tm_template_by_chan: Dict[int, mumble_pb2.TextMessage] = {}
 
     async def send(self, msg_type: str, payload: Any):
-        """Send a message to the WebSocket client"""
+        """Queue a message for the WebSocket client"""
+        self._outbox.put(orjson.dumps({"type": msg_type, "payload": payload}))
+        self._outbox_event.set()
+
+    def send_sync(self, msg_type: str, payload: Any):
+        """Queue a message from sync context (callbacks)"""
+        self.send_sync_raw(orjson.dumps({"type": msg_type, "payload": payload}))
+
+    def send_sync_raw(self, data: bytes):
+        """Queue a pre-encoded JSON message or tagged binary frame from sync context"""
+        self._outbox.put(data)
+        self.loop.call_soon_threadsafe(self._outbox_event.set)
+
+    def send_bin(self, frame: bytes):
+        """Queue a binary audio frame from the event loop thread"""
+        self._outbox.put(frame)
+        self._outbox_event.set()
+
+    async def _send_frame(self, data: bytes):
         try:
-            await self.ws.send(json.dumps({"type": msg_type, "payload": payload}))
+            await self.ws.send(data)
         except Exception as e:
             logger.error(f"Error sending to websocket: {e}")
 
-    def send_sync(self, msg_type: str, payload: Any):
-        """Send a message from sync context (callbacks)"""
-        asyncio.run_coroutine_threadsafe(self.send(msg_type, payload), self.loop)
+    async def _send_batch(self, batch: list):
+        if batch:
+            await self._send_frame(b"[" + b",".join(batch) + b"]")
+
+    async def _flush_outbox(self):
+        """Drain queued frames, sending JSON messages as arrays"""
+        # JSON messages always start with '{', so the tag byte tells them apart
+        while True:
+            await self._outbox_event.wait()
+            self._outbox_event.clear()
+
+            batch = []
+            while True:
+                try:
+                    item = self._outbox.get_nowait()
+                except queue.Empty:
+                    break
+
+                if item[0] in AUDIO_TAGS:
+                    # Preserve ordering relative to queued JSON messages
+                    await self._send_batch(batch)
+                    batch = []
+                    await self._send_frame(item)
+                else:
+                    batch.append(item)
+                    if len(batch) >= OUTBOX_MAX_BATCH:
+                        await self._send_batch(batch)
+                        batch = []
+
+            await self._send_batch(batch)
 
     def connect(self, address: str, port: int, username: str, insecure: bool = True):
         """Connect to a Mumble server"""
@@ -150,7 +322,8 @@ class MumbleClient:
         self.connected = True  # Set connected here so _sync_tree works
         self.send_sync("connected", {"status": "ok"})
         self.send_sync("log", {"text": "Connected to Mumble server", "level": "server"})
-        self._sync_tree()
+        # Tree syncs always run on the event loop thread
+        self.loop.call_soon_threadsafe(self._mark_tree_dirty)
 
     def _on_disconnected(self):
         """Called when disconnected from Mumble server"""
@@ -162,35 +335,70 @@ class MumbleClient:
         if not sound_chunk or not sound_chunk.pcm:
             return
 
-        session = user["session"]
+        # Only hand off here; buffering and framing run on the event loop thread.
+        # The event is cleared before the queue is drained, so one wakeup per batch suffices.
+        self._audio_q.put((user["session"], sound_chunk.pcm))
+        if not self._audio_event.is_set():
+            self.loop.call_soon_threadsafe(self._audio_event.set)
+
+    async def _flush_audio(self):
+        """Drain received audio chunks into the per-session buffers"""
+        get_nowait = self._audio_q.get_nowait
+        while True:
+            await self._audio_event.wait()
+            self._audio_event.clear()
+
+            frames = []
+            while True:
+                try:
+                    session, pcm = get_nowait()
+                except queue.Empty:
+                    break
+                frame = self._buffer_audio(session, pcm)
+                if frame is not None:
+                    frames.append((session, frame))
+
+            if not self._raw_frames:
+                for _, frame in frames:
+                    self.send_bin(frame)
+            elif frames:
+                await self._encode_raw_frames(frames)
+
+    async def _encode_raw_frames(self, frames: list):
+        """Frame and encode a batch of PCM buffers, across the worker pool while it works"""
+        pool = _audio_pool
+        encoded = None
+        if pool is not None:
+            run = self.loop.run_in_executor
+            try:
+                # gather returns results in submission order, keeping each user's frames in sequence
+                encoded = await asyncio.gather(*(run(pool, encode_audio_frame, self._audio_tag, session, pcm)
+                                                 for session, pcm in frames))
+            except BrokenProcessPool as e:
+                logger.error(f"Audio worker pool failed, encoding on the event loop from now on: {e}")
+                _disable_audio_pool()
+            except Exception as e:
+                logger.error(f"Error encoding audio in worker pool: {e}")
+
+        if encoded is None:
+            encoded = [encode_audio_frame(self._audio_tag, session, pcm) for session, pcm in frames]
 
-        # Buffer audio data
-        if session not in self.audio_buffers:
-            self.audio_buffers[session] = {
-                'data': bytearray(),
-                'name': user["name"],
-                'last_send': time_module.time()
-            }
+        for frame in encoded:
+            self.send_bin(frame)
+
+    def _buffer_audio(self, session: int, pcm: bytes) -> Optional[bytes]:
+        """Buffer audio for a user, returning a frame (raw PCM when pooled) once enough has accumulated"""
+        buffer = self.audio_buffers.get(session)
+        if buffer is None:
+            header = b"" if self._raw_frames else AUDIO_HEADER.pack(self._audio_tag, session, 48000)
+            # Room for a full frame plus the chunk that overshoots the target
+            buffer = AudioBuffer(header, self._now(), 2 * self._audio_target_bytes)
+            self.audio_buffers[session] = buffer
+
+        if self.AUDIO_ULAW and not self._raw_frames:
+            pcm = audioop.lin2ulaw(pcm, 2)
 
-        buffer = self.audio_buffers[session]
-        buffer['data'].extend(sound_chunk.pcm)
-
-        # Send when we have enough data (60ms worth = 5760 bytes at 48kHz 16-bit mono)
-        # Or if it's been more than 40ms since last send
-        bytes_per_ms = 48000 * 2 / 1000  # 96 bytes per ms
-        target_bytes = int(self.AUDIO_BUFFER_MS * bytes_per_ms)
-        time_since_send = time_module.time() - buffer['last_send']
-
-        if len(buffer['data']) >= target_bytes or (len(buffer['data']) > 0 and time_since_send > 0.04):
-            pcm_data = base64.b64encode(bytes(buffer['data'])).decode('utf-8')
-            self.send_sync("audio", {
-                "userId": str(session),
-                "userName": buffer['name'],
-                "data": pcm_data,
-                "sampleRate": 48000
-            })
-            buffer['data'] = bytearray()
-            buffer['last_send'] = time_module.time()
+        return buffer.append(pcm, self._now(), self._audio_target_bytes)
 
     def _on_text_message(self, message):
         """Called when a text message is received"""
@@ -203,25 +411,26 @@ class MumbleClient:
                 sender = user["name"]
                 sender_id = str(actor)
 
-        # Check if this is a video message
+        # Check if this is a video message; cheap checks keep ordinary chat off the JSON parser
         msg_content = message.message
-        try:
-            if msg_content.startswith('{') and '_wm_video' in msg_content:
-                parsed = json.loads(msg_content)
-                if parsed.get('_wm_video'):
-                    msg_type = parsed.get('type', 'unknown')
-                    frame_info = f" frame={parsed.get('frameId')} frag={parsed.get('fragmentIndex')}/{parsed.get('fragmentCount')}" if msg_type == 'video_frame' else ""
-                    logger.info(f"[Video] Received {msg_type}{frame_info} from {sender}")
-                    # Forward video message with type 'video'
-                    self.send_sync("video", {
-                        "sender": sender,
-                        "senderId": sender_id,
-                        "data": parsed
-                    })
-                    return  # Don't process as regular chat
-        except (json.JSONDecodeError, KeyError) as e:
-            logger.debug(f"Failed to parse potential video message: {e}")
-            pass  # Not a video message, process normally
+        if len(msg_content) > 10 and msg_content[0] == '{' and '"_wm_video"' in msg_content:
+            try:
+                parsed = orjson.loads(msg_content)
+            except orjson.JSONDecodeError as e:
+                logger.debug(f"Failed to parse potential video message: {e}")
+                parsed = None  # Not a video message, process normally
+
+            if isinstance(parsed, dict) and parsed.get('_wm_video'):
+                msg_type = parsed.get('type', 'unknown')
+                frame_info = f" frame={parsed.get('frameId')} frag={parsed.get('fragmentIndex')}/{parsed.get('fragmentCount')}" if msg_type == 'video_frame' else ""
+                logger.info(f"[Video] Received {msg_type}{frame_info} from {sender}")
+                # Forward video message with type 'video'
+                self.send_sync("video", {
+                    "sender": sender,
+                    "senderId": sender_id,
+                    "data": parsed
+                })
+                return  # Don't process as regular chat
 
         # Regular chat message
         self.send_sync("chat", {
@@ -231,10 +440,19 @@ class MumbleClient:
 
     def _on_user_change(self, *args):
         """Called when user state changes"""
-        self._sync_tree()
+        self.loop.call_soon_threadsafe(self._mark_tree_dirty)
 
     def _on_channel_change(self, *args):
         """Called when channel state changes"""
+        self.loop.call_soon_threadsafe(self._mark_tree_dirty)
+
+    def _mark_tree_dirty(self):
+        """Schedule a single tree sync for a burst of changes (event loop thread)"""
+        if self._tree_timer is None:
+            self._tree_timer = self.loop.call_later(TREE_SYNC_DEBOUNCE, self._do_sync)
+
+    def _do_sync(self):
+        self._tree_timer = None
         self._sync_tree()
 
     def _sync_tree(self):
@@ -243,15 +461,34 @@ class MumbleClient:
             return
 
         try:
-            tree = self._build_channel_tree(0)
-            self.send_sync("sync_tree", tree)
+            # Index users and channels once so the tree build is linear
+            users_by_channel = defaultdict(list)
+            for user in list(self.mumble.users.values()):
+                users_by_channel[user["channel_id"]].append(user)
+
+            children_by_parent = defaultdict(list)
+            for ch in list(self.mumble.channels.values()):
+                if ch.get("parent") != ch["channel_id"]:
+                    children_by_parent[ch.get("parent")].append(ch["channel_id"])
+
+            myself = self.mumble.users.myself
+            my_session = myself["session"] if myself else None
+
+            tree = self._build_channel_tree(0, users_by_channel, children_by_parent, my_session)
+            payload = orjson.dumps({"type": "sync_tree", "payload": tree})
+            # Skip the send when nothing visible changed (e.g. benign user updates)
+            if payload == self._last_tree_payload:
+                return
+            self._last_tree_payload = payload
+            self.send_sync_raw(payload)
         except Exception as e:
             logger.error(f"Error syncing tree: {e}")
 
-    def _build_channel_tree(self, channel_id: int) -> Dict[str, Any]:
-        """Recursively build the channel tree"""
-        channel = self.mumble.channels.get(channel_id)
-        if not channel:
+    def _build_channel_tree(self, root_id: int, users_by_channel: Dict[int, list],
+                            children_by_parent: Dict[Any, list], my_session: Optional[int]) -> Dict[str, Any]:
+        """Build the channel tree breadth-first from the precomputed indexes"""
+        channels = self.mumble.channels
+        if not channels.get(root_id):
             return {
                 "id": "0",
                 "name": "Root",
@@ -260,12 +497,19 @@ class MumbleClient:
                 "isExpanded": True
             }
 
-        # Get users in this channel
-        users = []
-        my_session = self.mumble.users.myself["session"] if self.mumble.users.myself else None
-
-        for user in self.mumble.users.values():
-            if user["channel_id"] == channel_id:
+        # First pass: build every reachable node, recording parents in BFS order
+        nodes: Dict[int, Dict[str, Any]] = {}
+        order = []
+        pending = deque([(root_id, None)])
+        while pending:
+            channel_id, parent_id = pending.popleft()
+            channel = channels.get(channel_id)
+            if not channel or channel_id in nodes:
+                continue
+
+            # Get users in this channel
+            users = []
+            for user in users_by_channel.get(channel_id, ()):
                 users.append({
                     "id": str(user["session"]),
                     "name": user["name"],
@@ -276,21 +520,26 @@ class MumbleClient:
                     "channelId": str(channel_id)
                 })
 
-        # Get child channels
-        children = []
-        for ch in self.mumble.channels.values():
-            if ch.get("parent") == channel_id and ch["channel_id"] != channel_id:
-                children.append(self._build_channel_tree(ch["channel_id"]))
-
-        return {
-            "id": str(channel_id),
-            "name": channel["name"],
-            "description": channel.get("description", ""),
-            "users": users,
-            "children": children,
-            "isExpanded": True,
-            "parentId": str(channel.get("parent", "")) if channel.get("parent") is not None else ""
-        }
+            nodes[channel_id] = {
+                "id": str(channel_id),
+                "name": channel["name"],
+                "description": channel.get("description", ""),
+                "users": users,
+                "children": [],
+                "isExpanded": True,
+                "parentId": str(channel.get("parent", "")) if channel.get("parent") is not None else ""
+            }
+            order.append((channel_id, parent_id))
+
+            for child_id in children_by_parent.get(channel_id, ()):
+                pending.append((child_id, channel_id))
+
+        # Second pass: attach each node to its parent, preserving sibling order
+        for channel_id, parent_id in order:
+            if parent_id is not None:
+                nodes[parent_id]["children"].append(nodes[channel_id])
+
+        return nodes[root_id]
 
     def join_channel(self, channel_id: int):
         """Move self to a channel"""
@@ -319,7 +568,7 @@ class MumbleClient:
             return
 
         # Check message length - Mumble has typical limits around 5KB
-        msg_len = len(text.encode('utf-8'))
+        msg_len = _utf8_len(text)
         if msg_len > 5000:
             logger.warning(f"Message too long ({msg_len} bytes), may fail")
             self.send_sync("log", {"text": f"Warning: Message too long ({msg_len} bytes), may fail", "level": "error"})
@@ -328,7 +577,7 @@ class MumbleClient:
             if channel_id is not None:
                 channel = self.mumble.channels.get(channel_id)
                 if channel:
-                    channel.send_text_message(text)
+                    self._send_channel_text(channel_id, text)
                 else:
                     logger.warning(f"Channel {channel_id} not found")
             else:
@@ -336,42 +585,80 @@ class MumbleClient:
                 my_channel = self.mumble.users.myself["channel_id"]
                 channel = self.mumble.channels.get(my_channel)
                 if channel:
-                    channel.send_text_message(text)
+                    self._send_channel_text(my_channel, text)
                 else:
                     logger.warning(f"Current channel {my_channel} not found")
         except Exception as e:
             logger.error(f"Error sending chat: {e}", exc_info=True)
             self.send_sync("log", {"text": f"Failed to send message: {e}", "level": "error"})
 
-    def send_direct_message(self, text: str, user_session_id: int):
-        """Send a direct/private message to a specific user"""
+    def _check_text_limits(self, text: str):
+        """Apply the server-advertised length limits, raising like pymumble's send_text_message"""
+        max_image_length = self.mumble.get_max_image_length()
+        if len(text) > max_image_length != 0:
+            raise ImageTooBigError(max_image_length)
+
+        if not ("<img" in text and "src" in text):
+            max_message_length = self.mumble.get_max_message_length()
+            if len(text) > max_message_length != 0:
+                raise TextTooLongError(max_message_length)
+
+    def _queue_text_message(self, textmessage: mumble_pb2.TextMessage):
+        """Serialize a TextMessage now and hand the packet to the pymumble thread"""
+        # Serializing here lets callers reuse the message object as soon as this returns
+        packet = struct.pack("!HL", PYMUMBLE_MSG_TYPES_TEXTMESSAGE, textmessage.ByteSize()) + textmessage.SerializeToString()
+        self.mumble.execute_command(SendPacketCmd(packet), blocking=False)
+
+    def _send_channel_text(self, channel_id: int, text: str):
+        """Send a text message to a channel using a cached TextMessage template"""
+        self._check_text_limits(text)
+
+        textmessage = self._tm_template_by_chan.get(channel_id)
+        if textmessage is None:
+            textmessage = mumble_pb2.TextMessage()
+            textmessage.channel_id.append(channel_id)
+            self._tm_template_by_chan[channel_id] = textmessage
+        textmessage.message = text
+        self._queue_text_message(textmessage)
+
+    def send_text_to_sessions(self, text: str, session_ids: list) -> list:
+        """Send one text message addressed to several users, returning the sessions not found"""
         if not self.mumble or not self.connected:
             logger.warning("Cannot send direct message: not connected")
-            return False
+            return list(session_ids)
+
+        users_get = self.mumble.users.get
+        present = []
+        missing = []
+        for sid in session_ids:
+            if users_get(sid):
+                present.append(sid)
+            else:
+                logger.warning(f"User session {sid} not found for direct message")
+                missing.append(sid)
+        if not present:
+            return missing
 
         try:
-            msg_len = len(text.encode('utf-8'))
+            msg_len = _utf8_len(text)
             if msg_len > 5000:
                 logger.warning(f"Direct message too long ({msg_len} bytes), may fail")
+            self._check_text_limits(text)
 
-            user = self.mumble.users.get(user_session_id)
-            if user:
-                user.send_text_message(text)
-                return True
-            else:
-                logger.warning(f"User session {user_session_id} not found for direct message")
-                return False
+            # One TextMessage with a repeated session field instead of one per recipient
+            textmessage = mumble_pb2.TextMessage()
+            textmessage.session.extend(present)
+            textmessage.message = text
+            self._queue_text_message(textmessage)
         except Exception as e:
+            # A failed send says nothing about whether recipients are still connected
             logger.error(f"Error sending direct message: {e}")
-            return False
+
+        return missing
 
     def send_to_multiple_users(self, text: str, user_session_ids: list):
         """Send a message to multiple specific users"""
-        if not self.mumble or not self.connected:
-            return
-
-        for session_id in user_session_ids:
-            self.send_direct_message(text, session_id)
+        self.send_text_to_sessions(text, user_session_ids)
 
     def disconnect(self):
         """Disconnect from Mumble server"""
@@ -379,87 +666,117 @@ class MumbleClient:
             self.mumble.stop()
             self.mumble = None
             self.connected = False
+            self._last_tree_payload = None
+            self._tm_template_by_chan.clear()
+
+    def close(self):
+        """Disconnect and stop the audio and outbound message pumps"""
+        self.disconnect()
+        if self._tree_timer is not None:
+            self._tree_timer.cancel()
+        self.audio_flush_task.cancel()
+        self._outbox_task.cancel()
+
+
+def _parse_channel_id(payload: Dict[str, Any]) -> Optional[int]:
+    channel_id = payload.get("channelId")
+    if channel_id is not None and channel_id != "":
+        return int(channel_id)
+    return None
+
+
+async def _h_connect(client: MumbleClient, payload: Dict[str, Any], websocket):
+    address = payload.get("address", "localhost")
+    port = int(payload.get("port", 64738))
+    username = payload.get("username", "WebMumbleUser")
+    insecure = payload.get("insecure", True)
+
+    try:
+        client.connect(address, port, username, insecure)
+    except Exception as e:
+        logger.error(f"Connection failed: {e}")
+        await client.send("error", {"message": str(e)})
+
+
+async def _h_chat(client: MumbleClient, payload: Dict[str, Any], websocket):
+    text = payload.get("text", "")
+    channel_id = _parse_channel_id(payload)
+    logger.info(f"Sending chat to channel {channel_id}: {text[:100]}...")
+    client.send_chat(text, channel_id)
+
+
+async def _h_join_channel(client: MumbleClient, payload: Dict[str, Any], websocket):
+    channel_id = int(payload.get("channelId", 0))
+    client.join_channel(channel_id)
+
+
+async def _h_disconnect(client: MumbleClient, payload: Dict[str, Any], websocket):
+    client.disconnect()
+
+
+async def _h_video_channel(client: MumbleClient, payload: Dict[str, Any], websocket):
+    # Send video announcement to channel (start/stop streaming)
+    video_data = payload.get("data", {})
+    video_json = orjson.dumps(video_data).decode()
+    client.send_chat(video_json, _parse_channel_id(payload))
+
+
+async def _h_video_direct(client: MumbleClient, payload: Dict[str, Any], websocket):
+    # Send video frame/message to specific user(s)
+    video_data = payload.get("data", {})
+    video_json = orjson.dumps(video_data).decode()
+    target_ids = payload.get("targetIds", [])
+    vmsg_type = video_data.get('type', 'unknown')
+    if vmsg_type == 'video_frame':
+        logger.debug(f"[Video] Sending frame {video_data.get('frameId')} frag {video_data.get('fragmentIndex')}/{video_data.get('fragmentCount')} to {len(target_ids)} users")
+    else:
+        logger.info(f"[Video] Sending {vmsg_type} to {target_ids}")
+    session_ids = []
+    for target_id in target_ids:
+        try:
+            session_ids.append(int(target_id))
+        except (ValueError, TypeError) as e:
+            logger.error(f"[Video] Error sending to {target_id}: {e}")
+
+    for session_id in client.send_text_to_sessions(video_json, session_ids):
+        # Notify frontend that this subscriber is gone
+        await client.send("subscriber_gone", {"userId": str(session_id)})
+
+
+# Handlers for JSON messages from the browser, keyed by message type
+HANDLERS = {
+    "connect": _h_connect,
+    "chat": _h_chat,
+    "join_channel": _h_join_channel,
+    "disconnect": _h_disconnect,
+    "video_channel": _h_video_channel,
+    "video_direct": _h_video_direct,
+}
 
 
 async def handle_client(websocket):
     """Handle a WebSocket client connection"""
     logger.info("WebSocket client connected")
     client = MumbleClient(websocket)
+    send_audio = client.send_audio
+    loads = orjson.loads
+    handlers_get = HANDLERS.get
 
     try:
         async for message in websocket:
+            # Binary frames carry microphone audio with the same header as outbound audio
+            if isinstance(message, bytes):
+                if len(message) > AUDIO_HEADER.size and message[0] == AUDIO_TAG:
+                    send_audio(message[AUDIO_HEADER.size:])
+                continue
+
             try:
-                msg = json.loads(message)
-                msg_type = msg.get("type")
-                payload = msg.get("payload", {})
-
-                if msg_type == "connect":
-                    address = payload.get("address", "localhost")
-                    port = int(payload.get("port", 64738))
-                    username = payload.get("username", "WebMumbleUser")
-                    insecure = payload.get("insecure", True)
-
-                    try:
-                        client.connect(address, port, username, insecure)
-                    except Exception as e:
-                        logger.error(f"Connection failed: {e}")
-                        await client.send("error", {"message": str(e)})
-
-                elif msg_type == "chat":
-                    text = payload.get("text", "")
-                    channel_id = payload.get("channelId")
-                    if channel_id is not None and channel_id != "":
-                        channel_id = int(channel_id)
-                    else:
-                        channel_id = None
-                    logger.info(f"Sending chat to channel {channel_id}: {text[:100]}...")
-                    client.send_chat(text, channel_id)
-
-                elif msg_type == "join_channel":
-                    channel_id = int(payload.get("channelId", 0))
-                    client.join_channel(channel_id)
-
-                elif msg_type == "audio":
-                    # Receive audio from browser
-                    pcm_b64 = payload.get("data", "")
-                    if pcm_b64:
-                        pcm_data = base64.b64decode(pcm_b64)
-                        client.send_audio(pcm_data)
-
-                elif msg_type == "disconnect":
-                    client.disconnect()
-
-                elif msg_type == "video_channel":
-                    # Send video announcement to channel (start/stop streaming)
-                    video_data = payload.get("data", {})
-                    video_json = json.dumps(video_data)
-                    channel_id = payload.get("channelId")
-                    if channel_id is not None and channel_id != "":
-                        channel_id = int(channel_id)
-                    else:
-                        channel_id = None
-                    client.send_chat(video_json, channel_id)
-
-                elif msg_type == "video_direct":
-                    # Send video frame/message to specific user(s)
-                    video_data = payload.get("data", {})
-                    video_json = json.dumps(video_data)
-                    target_ids = payload.get("targetIds", [])
-                    vmsg_type = video_data.get('type', 'unknown')
-                    if vmsg_type == 'video_frame':
-                        logger.debug(f"[Video] Sending frame {video_data.get('frameId')} frag {video_data.get('fragmentIndex')}/{video_data.get('fragmentCount')} to {len(target_ids)} users")
-                    else:
-                        logger.info(f"[Video] Sending {vmsg_type} to {target_ids}")
-                    for target_id in target_ids:
-                        try:
-                            success = client.send_direct_message(video_json, int(target_id))
-                            if not success:
-                                # Notify frontend that this subscriber is gone
-                                await client.send("subscriber_gone", {"userId": str(target_id)})
-                        except (ValueError, TypeError) as e:
-                            logger.error(f"[Video] Error sending to {target_id}: {e}")
-
-            except json.JSONDecodeError:
+                msg = loads(message)
+                handler = handlers_get(msg.get("type"))
+                if handler:
+                    await handler(client, msg.get("payload", {}), websocket)
+
+            except orjson.JSONDecodeError:
                 logger.error("Invalid JSON received")
             except Exception as e:
                 logger.error(f"Error handling message: {e}")
@@ -467,18 +784,50 @@ async def handle_client(websocket):
     except websockets.exceptions.ConnectionClosed:
         logger.info("WebSocket client disconnected")
     finally:
-        client.disconnect()
+        client.close()
+
+
+def check_protobuf_backend():
+    """Warn if protobuf is running its pure-Python implementation"""
+    from google.protobuf.internal import api_implementation
+
+    impl = api_implementation.Type()
+    if impl == "python":
+        logger.warning("protobuf is using the pure-Python implementation; Mumble control messages "
+                       "will be slow. Install a protobuf wheel with the upb/cpp backend.")
+    else:
+        logger.info(f"protobuf implementation: {impl}")
 
 
 async def main():
     """Main entry point"""
+    global _audio_pool
+
+    check_protobuf_backend()
     port = 9847
     logger.info(f"WebMumble backend starting on port {port}")
     logger.info(f"WebSocket endpoint: ws://localhost:{port}/ws")
 
-    async with websockets.serve(handle_client, "0.0.0.0", port):
-        await asyncio.Future()  # Run forever
+    if AUDIO_ENCODE_WORKERS > 0:
+        # spawn, not fork: pymumble and the event loop run threads that must not be forked
+        _audio_pool = ProcessPoolExecutor(max_workers=AUDIO_ENCODE_WORKERS,
+                                          mp_context=multiprocessing.get_context("spawn"))
+        logger.info(f"Encoding audio in {AUDIO_ENCODE_WORKERS} worker processes")
+
+    try:
+        # PCM and video payloads compress poorly, so skip permessage-deflate entirely
+        async with websockets.serve(handle_client, "0.0.0.0", port, compression=None,
+                                    max_size=2**20, max_queue=64, ping_interval=20):
+            await asyncio.Future()  # Run forever
+    finally:
+        _disable_audio_pool()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        import uvloop
+    except ImportError:
+        logger.info("uvloop not available, using default asyncio event loop")
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
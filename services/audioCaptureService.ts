@@ -1,7 +1,7 @@
 // Audio capture service with RNNoise noise suppression
 // Captures microphone input, processes through RNNoise, sends PCM to backend
 
-type AudioSendCallback = (pcmData: string) => void;
+type AudioSendCallback = (pcmData: ArrayBuffer) => void;
 
 // RNNoise processes 480 samples (10ms at 48kHz) at a time
 const RNNOISE_FRAME_SIZE = 480;
@@ -90,14 +90,7 @@ export class AudioCaptureService {
           pcmData[i] = s < 0 ? s * 0x8000 : s * 0x7fff;
         }
 
-        // Convert to base64 and send
-        const bytes = new Uint8Array(pcmData.buffer);
-        let binary = '';
-        for (let i = 0; i < bytes.length; i++) {
-          binary += String.fromCharCode(bytes[i]);
-        }
-        const base64 = btoa(binary);
-        self.onSendAudio(base64);
+        self.onSendAudio(pcmData.buffer);
       };
 
       // Connect the audio graph
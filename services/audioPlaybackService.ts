@@ -3,11 +3,23 @@
 
 interface AudioPacket {
   userId: string;
-  userName: string;
-  data: string; // base64 encoded PCM
+  data: ArrayBuffer; // raw 16-bit PCM or 8-bit mu-law, per codec
   sampleRate: number;
+  codec?: 'pcm16' | 'mulaw';
 }
 
+// G.711 mu-law byte -> Float32 sample (-1.0 to 1.0), matching Python's audioop.ulaw2lin
+const MULAW_TABLE = (() => {
+  const table = new Float32Array(256);
+  for (let i = 0; i < 256; i++) {
+    const u = ~i & 0xff;
+    const exponent = (u >> 4) & 0x07;
+    const sample = ((((u & 0x0f) << 3) + 0x84) << exponent) - 0x84;
+    table[i] = ((u & 0x80) ? -sample : sample) / 32768.0;
+  }
+  return table;
+})();
+
 interface UserAudioStream {
   lastActivity: number;
   nextPlayTime: number;
@@ -65,20 +77,23 @@ export class AudioPlaybackService {
     if (!this.audioContext || !this.isPlaying || !this.masterGain) return;
 
     try {
-      // Decode base64 to bytes
-      const binaryString = atob(packet.data);
-      const bytes = new Uint8Array(binaryString.length);
-      for (let i = 0; i < binaryString.length; i++) {
-        bytes[i] = binaryString.charCodeAt(i);
-      }
-
-      // Convert bytes to Int16 samples
-      const int16Samples = new Int16Array(bytes.buffer);
-
-      // Convert Int16 to Float32 (-1.0 to 1.0)
-      const floatSamples = new Float32Array(int16Samples.length);
-      for (let i = 0; i < int16Samples.length; i++) {
-        floatSamples[i] = int16Samples[i] / 32768.0;
+      let floatSamples: Float32Array;
+      if (packet.codec === 'mulaw') {
+        // Expand mu-law bytes through the lookup table
+        const ulawSamples = new Uint8Array(packet.data);
+        floatSamples = new Float32Array(ulawSamples.length);
+        for (let i = 0; i < ulawSamples.length; i++) {
+          floatSamples[i] = MULAW_TABLE[ulawSamples[i]];
+        }
+      } else {
+        // Convert bytes to Int16 samples
+        const int16Samples = new Int16Array(packet.data);
+
+        // Convert Int16 to Float32 (-1.0 to 1.0)
+        floatSamples = new Float32Array(int16Samples.length);
+        for (let i = 0; i < int16Samples.length; i++) {
+          floatSamples[i] = int16Samples[i] / 32768.0;
+        }
       }
 
       // Get or create user stream
@@ -2,6 +2,15 @@ import { ServerConfig } from '../types';
 
 type MessageHandler = (type: string, payload: any) => void;
 
+// Binary audio frame header (both directions): msg-type u8, session u32, sample rate u16 (little-endian)
+// The msg-type byte also names the codec: 16-bit linear PCM or 8-bit mu-law
+const AUDIO_TAG = 0x01;
+const AUDIO_ULAW_TAG = 0x02;
+const BINARY_HEADER_SIZE = 7;
+
+// The backend sends JSON as UTF-8 binary frames; any frame not tagged as audio is JSON
+const textDecoder = new TextDecoder();
+
 export class MumbleSocketService {
   private ws: WebSocket | null = null;
   private messageHandler: MessageHandler;
@@ -30,6 +39,7 @@ export class MumbleSocketService {
       
       try {
         this.ws = new WebSocket(wsUrl);
+        this.ws.binaryType = 'arraybuffer';
       } catch (e) {
         reject(new Error("Failed to construct WebSocket. Ensure the Go backend is running and you are accessing it via the correct protocol."));
         return;
@@ -48,23 +58,42 @@ export class MumbleSocketService {
         this.send('connect', config);
       };
 
+      const dispatch = (msg: { type: string; payload: any }) => {
+        if (msg.type === 'connected') {
+          resolve();
+        } else if (msg.type === 'error') {
+            console.error("Backend Error:", msg.payload);
+            // If we are still in connecting phase, reject
+            if (this.ws?.readyState === WebSocket.OPEN) {
+               // We might already be resolved, so this is just a runtime error log
+            }
+            // If this happens during handshake, we might want to reject logic, 
+            // but since 'connected' hasn't fired yet, the promise is pending.
+            // However, we rely on resolve() being called on success.
+        } else {
+            this.messageHandler(msg.type, msg.payload);
+        }
+      };
+
       this.ws.onmessage = (event) => {
+        let text: string;
+        if (event.data instanceof ArrayBuffer) {
+          const tag = event.data.byteLength > 0 ? new Uint8Array(event.data, 0, 1)[0] : 0;
+          if (tag === AUDIO_TAG || tag === AUDIO_ULAW_TAG) {
+            this.handleAudioFrame(event.data);
+            return;
+          }
+          text = textDecoder.decode(event.data);
+        } else {
+          text = event.data;
+        }
+
         try {
-          const msg = JSON.parse(event.data);
-          
-          if (msg.type === 'connected') {
-            resolve();
-          } else if (msg.type === 'error') {
-              console.error("Backend Error:", msg.payload);
-              // If we are still in connecting phase, reject
-              if (this.ws?.readyState === WebSocket.OPEN) {
-                 // We might already be resolved, so this is just a runtime error log
-              }
-              // If this happens during handshake, we might want to reject logic, 
-              // but since 'connected' hasn't fired yet, the promise is pending.
-              // However, we rely on resolve() being called on success.
-          } else {
-              this.messageHandler(msg.type, msg.payload);
+          const data = JSON.parse(text);
+          // Backend coalesces messages into arrays; accept single objects too
+          const messages = Array.isArray(data) ? data : [data];
+          for (const msg of messages) {
+            dispatch(msg);
           }
         } catch (e) {
           console.error("Failed to parse websocket message", e);
@@ -89,12 +118,36 @@ export class MumbleSocketService {
     });
   }
 
+  private handleAudioFrame(data: ArrayBuffer) {
+    if (data.byteLength < BINARY_HEADER_SIZE) return;
+
+    const view = new DataView(data);
+    this.messageHandler('audio', {
+      userId: String(view.getUint32(1, true)),
+      sampleRate: view.getUint16(5, true),
+      codec: view.getUint8(0) === AUDIO_ULAW_TAG ? 'mulaw' : 'pcm16',
+      data: data.slice(BINARY_HEADER_SIZE),
+    });
+  }
+
   public send(type: string, payload: any) {
     if (this.ws && this.ws.readyState === WebSocket.OPEN) {
       this.ws.send(JSON.stringify({ type, payload }));
     }
   }
 
+  public sendAudio(pcm: ArrayBuffer) {
+    if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+      const frame = new Uint8Array(BINARY_HEADER_SIZE + pcm.byteLength);
+      const view = new DataView(frame.buffer);
+      view.setUint8(0, AUDIO_TAG);
+      view.setUint32(1, 0, true); // Session is assigned by the backend's Mumble connection
+      view.setUint16(5, 48000, true);
+      frame.set(new Uint8Array(pcm), BINARY_HEADER_SIZE);
+      this.ws.send(frame);
+    }
+  }
+
   public disconnect() {
     if (this.ws) {
       this.ws.close();